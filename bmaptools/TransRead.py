@@ -21,20 +21,42 @@ them on-the-fly if needed. Remote files are read using urllib (except of
 'bz2', 'gz', 'xz', 'lzo', 'zst' and a "tar" version of them: 'tar.bz2', 'tbz2',
 'tbz', 'tb2', 'tar.gz', 'tgz', 'tar.xz', 'txz', 'tar.lzo', 'tzo', 'tar.lz4',
 'tlz4', '.tar.zst', 'tzst'.
-This module uses the following system programs for decompressing: pbzip2, bzip2,
-gzip, pigz, xz, lzop, lz4, zstd, tar and unzip.
+This module uses the following system programs for decompressing: lbzip2,
+pbzip2, bzip2, rapidgzip, gzip, pigz, pixz, xz, lzop, lz4, zstd, tar and unzip.
+Note, 'lbzip2' is preferred over 'pbzip2' because it decompresses any bzip2
+file in parallel, while 'pbzip2' can do this only for files compressed by
+'pbzip2'.
+If the "isal" Python module is installed, gzip-compressed files are
+decompressed in-process using its 'igzip' bindings instead of 'gzip'/'pigz'.
+Tar archives decompressed in-process are read using the 'tarfile' module,
+unless 'USE_NATIVE_TAR' is 'False'. Otherwise the 'tar' program is used.
 """
 
 import os
+import re
 import io
 import errno
+import fcntl
+import collections
 import sys
 import logging
+import tarfile
 import threading
+import zlib
+import socket
 import subprocess
+from six.moves import queue
+from six.moves import http_client as httplib
 from six.moves.urllib import parse as urlparse
+from six.moves.urllib import request as urllib
+from six.moves.urllib.error import URLError
 from bmaptools import BmapHelpers
 
+try:
+    from isal import igzip, isal_zlib
+except ImportError:
+    igzip = isal_zlib = None
+
 _log = logging.getLogger(__name__)  # pylint: disable=C0103
 
 # Disable the following pylint errors and recommendations:
@@ -56,6 +78,165 @@ SUPPORTED_COMPRESSION_TYPES = ('bz2', 'gz', 'xz', 'lzo', 'lz4', 'zst',
                                'tar.gz', 'tar.bz2', 'tar.xz', 'tar.lzo',
                                'tar.lz4', 'tar.zst', 'zip')
 
+# Programs for decompressing gzip files in the order of preference, and the
+# arguments they need to decompress standard input to standard output.
+# "rapidgzip" decompresses in parallel using all the CPUs.
+PARALLEL_GZIP_PROGRAMS = [("rapidgzip", ["-d", "-c", "-P", "0"]),
+                          ("pigz", ["-d", "-c"]),
+                          ("gzip", ["-d", "-c"])]
+
+
+# Whether tar archives which are decompressed in-process should be read with the
+# 'tarfile' module rather than the "tar" program, so that no program needs to be
+# started at all. It may be switched off for archives which only GNU tar
+# understands. Archives decompressed by an external program are always read by
+# the "tar" program, because 'tarfile' is slower than it.
+USE_NATIVE_TAR = True
+
+# Size of the chunks we copy or skip data in, and the capacity we try to set for
+# the pipes to and from the decompressor
+_CHUNK_SIZE = 1024 * 1024
+
+# Name of the environment variable which enables caching of the recently read
+# data of compressed files and URLs, which makes it possible to seek backwards
+# or re-read the data. The value is the cache size in MiB, e.g., 64.
+CACHE_SIZE_ENV = "BMAPTOOLS_READ_CACHE_MIB"
+
+# How many chunks may be buffered between reading the data from the network and
+# writing them to the decompressor
+_PIPELINE_DEPTH = 8
+
+# The 'F_SETPIPE_SZ' fcntl command for changing pipe capacity (Linux-specific)
+_F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+# Exceptions which the in-process decompressors raise for corrupted or truncated
+# data
+_DECOMPRESSION_ERRORS = (EOFError, IOError, OSError, zlib.error)
+if isal_zlib:
+    _DECOMPRESSION_ERRORS += (isal_zlib.error, )
+
+# Supported file name extensions, the compression type for each of them, and
+# whether the file is a tar archive
+_EXTENSIONS = {".gz": ("gzip", False),
+               ".gzip": ("gzip", False),
+               ".tar.gz": ("gzip", True),
+               ".tgz": ("gzip", True),
+               ".bz2": ("bzip2", False),
+               ".tar.bz2": ("bzip2", True),
+               ".tbz": ("bzip2", True),
+               ".tbz2": ("bzip2", True),
+               ".tb2": ("bzip2", True),
+               ".xz": ("xz", False),
+               ".tar.xz": ("xz", True),
+               ".txz": ("xz", True),
+               ".lzo": ("lzo", False),
+               ".tar.lzo": ("lzo", True),
+               ".tzo": ("lzo", True),
+               ".lz4": ("lz4", False),
+               ".tar.lz4": ("lz4", True),
+               ".tlz4": ("lz4", True),
+               ".zst": ("zst", False),
+               ".tar.zst": ("zst", True),
+               ".tzst": ("zst", True),
+               ".zip": ("zip", False)}
+
+# A regular expression matching any of the supported extensions at the end of
+# a file name. The longer extensions go first, so that, e.g., ".tar.gz" is
+# matched rather than ".gz".
+_EXT_RE = re.compile(r"(?:%s)\Z" %
+                     "|".join(re.escape(suffix) for suffix in
+                              sorted(_EXTENSIONS, key=len, reverse=True)))
+
+
+def _get_compression_type(name):
+    """
+    Return a '(compression_type, is_tar)' tuple for file 'name' based on its
+    extension. The compression type is 'None' if the file is not compressed.
+    """
+
+    match = _EXT_RE.search(name)
+    if match:
+        return _EXTENSIONS[match.group(0)]
+
+    return None, False
+
+
+def _set_pipe_size(file_obj, size):
+    """
+    Try to set the capacity of the pipe behind 'file_obj' to 'size' bytes. The
+    default capacity is usually only 64KiB, which makes the process writing to
+    the pipe block too often. Failures are ignored, because this is just an
+    optimization.
+    """
+
+    try:
+        fcntl.fcntl(file_obj.fileno(), _F_SETPIPE_SZ, size)
+    except (IOError, OSError):
+        pass
+
+
+def _fadvise(file_obj, advice):
+    """
+    Advise the kernel about the way the entire 'file_obj' file is going to be
+    accessed. The 'advice' argument is the name of one of the
+    'os.POSIX_FADV_*' constants. Failures are ignored, because this is just
+    an optimization, and 'os.posix_fadvise()' is not available on all
+    platforms and Python versions.
+    """
+
+    try:
+        os.posix_fadvise(file_obj.fileno(), 0, 0, getattr(os, advice))
+    except (AttributeError, OSError):
+        pass
+
+
+def _get_seek_position(cur_pos, offset, whence):
+    """
+    Return the position the 'seek()' method should move to from position
+    'cur_pos'. The 'whence' argument may be either 'os.SEEK_SET' or
+    'os.SEEK_CUR'.
+    """
+
+    if whence == os.SEEK_SET:
+        return offset
+    if whence == os.SEEK_CUR:
+        return cur_pos + offset
+
+    raise Error("'seek()' method requires the 'whence' argument "
+                "to be %d or %d, but %d was passed"
+                % (os.SEEK_SET, os.SEEK_CUR, whence))
+
+
+def _get_cache_size():
+    """
+    Return how many blocks of '_CHUNK_SIZE' bytes the read cache may hold, as
+    requested by the 'CACHE_SIZE_ENV' environment variable. Returns 0 if the
+    cache is disabled.
+    """
+
+    value = os.environ.get(CACHE_SIZE_ENV)
+    if not value:
+        return 0
+
+    try:
+        size = int(value) * 1024 * 1024
+    except ValueError:
+        _log.warning("ignoring bad \"%s\" environment variable value \"%s\", "
+                     "it should be the cache size in MiB"
+                     % (CACHE_SIZE_ENV, value))
+        return 0
+
+    return max(size // _CHUNK_SIZE, 0)
+
+
+def _is_seekable(file_obj):
+    """Returns 'True' if the 'file_obj' file object supports seeking."""
+
+    try:
+        return file_obj.seekable()
+    except AttributeError:
+        return False
+
 
 def _fake_seek_forward(file_obj, cur_pos, offset, whence=os.SEEK_SET):
     """
@@ -64,15 +245,7 @@ def _fake_seek_forward(file_obj, cur_pos, offset, whence=os.SEEK_SET):
     'os.SEEK_SET' or 'os.SEEK_CUR'.
     """
 
-    if whence == os.SEEK_SET:
-        new_pos = offset
-    elif whence == os.SEEK_CUR:
-        new_pos = cur_pos + offset
-    else:
-        raise Error("'seek()' method requires the 'whence' argument "
-                    "to be %d or %d, but %d was passed"
-                    % (os.SEEK_SET, os.SEEK_CUR, whence))
-
+    new_pos = _get_seek_position(cur_pos, offset, whence)
     if new_pos < cur_pos:
         raise Error("''seek()' method supports only seeking forward, "
                     "seeking from %d to %d is not allowed"
@@ -80,12 +253,26 @@ def _fake_seek_forward(file_obj, cur_pos, offset, whence=os.SEEK_SET):
 
     length = new_pos - cur_pos
     to_read = length
-    while to_read > 0:
-        chunk_size = min(to_read, 1024 * 1024)
-        buf = file_obj.read(chunk_size)
-        if not buf:
-            break
-        to_read -= len(buf)
+    if _is_seekable(file_obj):
+        start = file_obj.tell()
+        to_read -= file_obj.seek(length, os.SEEK_CUR) - start
+    elif hasattr(file_obj, "readinto"):
+        # Read all the chunks into the same buffer, instead of allocating a new
+        # one for every chunk
+        buf = memoryview(bytearray(min(to_read, _CHUNK_SIZE)))
+        while to_read > 0:
+            chunk_size = min(to_read, len(buf))
+            size = file_obj.readinto(buf[:chunk_size])
+            if not size:
+                break
+            to_read -= size
+    else:
+        while to_read > 0:
+            chunk_size = min(to_read, _CHUNK_SIZE)
+            buf = file_obj.read(chunk_size)
+            if not buf:
+                break
+            to_read -= len(buf)
 
     if to_read < 0:
         raise Error("seeked too far: %d instead of %d"
@@ -103,32 +290,133 @@ class Error(Exception):
     pass
 
 
+class _DecompressedFile(object):
+    """
+    A file-like object which reads the data from an in-process decompressor,
+    and turns the errors about corrupted or truncated data into 'Error'
+    exceptions, like the ones for unreadable tar archives.
+    """
+
+    def __init__(self, file_obj, name):
+        """
+        Class constructor. The 'file_obj' argument is the decompressor file
+        object, and 'name' is the compressed file name for error messages.
+        """
+
+        self._file_obj = file_obj
+        self._name = name
+
+    def read(self, size=-1):
+        """Read and decompress up to 'size' bytes."""
+
+        try:
+            return self._file_obj.read(size)
+        except _DECOMPRESSION_ERRORS as err:
+            raise Error("cannot decompress '%s': %s" % (self._name, err))
+
+    def readinto(self, buf):
+        """Read and decompress up to 'len(buf)' bytes into 'buf'."""
+
+        try:
+            return self._file_obj.readinto(buf)
+        except _DECOMPRESSION_ERRORS as err:
+            raise Error("cannot decompress '%s': %s" % (self._name, err))
+
+    def close(self):
+        """Close the file-like object."""
+        self._file_obj.close()
+
+
+class _TarReader(object):
+    """
+    A file-like object which reads the contents of all the regular files in a
+    tar archive opened in streaming mode one after another, the same way the
+    "tar -x -O" command outputs them.
+    """
+
+    def __init__(self, tar, name):
+        """
+        Class constructor. The 'tar' argument is the 'tarfile.TarFile' object
+        opened in streaming mode, and 'name' is the archive name for error
+        messages.
+        """
+
+        self._tar = tar
+        self._name = name
+        # The file object of the regular file we are currently reading, 'None'
+        # if there are no more regular files
+        self._member_obj = None
+        self._next_member()
+
+    def _next_member(self):
+        """Switch to the next regular file of the archive."""
+
+        try:
+            member = self._tar.next()
+            while member is not None and not member.isfile():
+                member = self._tar.next()
+        except (tarfile.TarError, IOError, EOFError) as err:
+            raise Error("cannot read tar archive '%s': %s" % (self._name, err))
+
+        if member is None:
+            self._member_obj = None
+        else:
+            self._member_obj = self._tar.extractfile(member)
+
+    def is_empty(self):
+        """Returns 'True' if the archive does not contain regular files."""
+        return self._member_obj is None
+
+    def read(self, size=-1):
+        """
+        Read 'size' bytes, or everything if 'size' is negative, continuing with
+        the next regular file when the current one ends.
+        """
+
+        parts = []
+        while self._member_obj is not None and size != 0:
+            try:
+                buf = self._member_obj.read(size)
+            except (tarfile.TarError, IOError, EOFError) as err:
+                raise Error("cannot read tar archive '%s': %s"
+                            % (self._name, err))
+            if not buf:
+                self._next_member()
+                continue
+
+            parts.append(buf)
+            if size > 0:
+                size -= len(buf)
+
+        return b"".join(parts)
+
+    def close(self):
+        """Close the file-like object."""
+        if self._member_obj is not None:
+            self._member_obj.close()
+            self._member_obj = None
+
+
+# Human-readable descriptions of the "sshpass" command-line tool's exit codes,
+# see "man sshpass"
+_SSHPASS_EXIT_CODES = {1: "invalid command line argument",
+                       2: "conflicting arguments given",
+                       3: "general run-time error",
+                       4: "unrecognized response from ssh (parse error)",
+                       5: "invalid/incorrect password",
+                       6: "host public key is unknown. sshpass exits without "
+                          "confirming the new key",
+                       # SSH returns 255 on any error
+                       255: "ssh error"}
+
+
 def _decode_sshpass_exit_code(code):
     """
     A helper function which converts "sshpass" command-line tool's exit code
     into a human-readable string. See "man sshpass".
     """
 
-    if code == 1:
-        result = "invalid command line argument"
-    elif code == 2:
-        result = "conflicting arguments given"
-    elif code == 3:
-        result = "general run-time error"
-    elif code == 4:
-        result = "unrecognized response from ssh (parse error)"
-    elif code == 5:
-        result = "invalid/incorrect password"
-    elif code == 6:
-        result = "host public key is unknown. sshpass exits without " \
-                 "confirming the new key"
-    elif code == 255:
-        # SSH result =s 255 on any error
-        result = "ssh error"
-    else:
-        result = "unknown"
-
-    return result
+    return _SSHPASS_EXIT_CODES.get(code, "unknown")
 
 
 class TransRead(object):
@@ -155,8 +443,8 @@ class TransRead(object):
         self.is_url = False
         # List of child processes we forked
         self._child_processes = []
-        # The reader thread
-        self._rthread = None
+        # The threads feeding data to the decompressor
+        self._threads = []
         # This variable becomes 'True' when the instance of this class is not
         # usable any longer.
         self._done = False
@@ -172,6 +460,13 @@ class TransRead(object):
 
         self._fake_seek = False
         self._pos = 0
+        # The read cache of recently read '_CHUNK_SIZE' blocks indexed by the
+        # block number, or 'None' if it is disabled. The cache is only used
+        # for the files we cannot seek, and then 'self._stream_pos' is the
+        # position in 'self._f_objs[-1]'.
+        self._cache = None
+        self._cache_blocks = 0
+        self._stream_pos = 0
 
         try:
             self._f_objs.append(open(self.name, "rb"))
@@ -181,21 +476,55 @@ class TransRead(object):
                 self._open_url(filepath)
             else:
                 raise Error("cannot open file '%s': %s" % (filepath, err))
+        else:
+            _fadvise(self._f_objs[0], "POSIX_FADV_SEQUENTIAL")
 
         self._open_compressed_file()
 
+        if self.compression_type == 'none' and not self.is_url:
+            self._use_file_methods()
+        elif self.is_url and not _is_seekable(self._f_objs[-1]):
+            # Uncompressed data received via urllib2 can be only read forward
+            self._fake_seek = True
+
+        if self._fake_seek:
+            self._cache_blocks = _get_cache_size()
+            if self._cache_blocks:
+                self._cache = collections.OrderedDict()
+
+    def _use_file_methods(self):
+        """
+        Local uncompressed files need no special handling, so if the file is
+        seekable, make the 'read()', 'seek()', 'tell()' and 'fileno()' methods
+        of this object be the methods of the file object.
+        """
+
+        file_obj = self._f_objs[-1]
+        if not _is_seekable(file_obj):
+            return
+
+        self.read = file_obj.read
+        self.seek = file_obj.seek
+        self.tell = file_obj.tell
+        self.fileno = file_obj.fileno
+
     def __del__(self):
         """The class destructor which closes opened files."""
         self._done = True
 
         if getattr(self, "_f_objs"):
+            if not self.is_url:
+                # We usually read the file only once, so do not keep it in the
+                # page cache
+                _fadvise(self._f_objs[0], "POSIX_FADV_DONTNEED")
             for file_obj in self._f_objs:
                 file_obj.close()
             self._f_objs = None
 
-        if getattr(self, "_rthread"):
-            self._rthread.join()
-            self._rthread = None
+        if getattr(self, "_threads"):
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
 
         if getattr(self, "_child_processes"):
             for child in self._child_processes:
@@ -204,23 +533,57 @@ class TransRead(object):
                     child.wait()
             self._child_processes = []
 
-    def _read_thread(self, f_from, f_to):
+    def _read_thread(self, f_from, full_bufs, free_bufs):
         """
         This function is used when reading compressed files. It runs in a
-        spearate thread, reads data from the 'f_from' file-like object, and
-        writes them to the 'f_to' file-like object. 'F_from' may be a urllib
-        object, while 'f_to' is usually stdin of the decompressor process.
+        separate thread, reads data from the 'f_from' file-like object into
+        buffers taken from the 'free_bufs' queue, and passes the filled buffers
+        to the writer thread via the 'full_bufs' queue. 'F_from' is usually a
+        urllib object.
         """
 
-        chunk_size = 1024 * 1024
         try:
             while not self._done:
-                buf = f_from.read(chunk_size)
-                if not buf:
+                buf = free_bufs.get()
+                if buf is None:
+                    # The writer thread has stopped
+                    break
+
+                if hasattr(f_from, "readinto"):
+                    size = f_from.readinto(buf)
+                else:
+                    data = f_from.read(len(buf))
+                    size = len(data)
+                    buf[:size] = data
+                if not size:
                     break
 
-                f_to.write(buf)
+                full_bufs.put((buf, size))
         finally:
+            full_bufs.put(None)
+
+    def _write_thread(self, f_to, full_bufs, free_bufs):
+        """
+        This function is used when reading compressed files. It runs in a
+        separate thread, takes the buffers filled by the reader thread from the
+        'full_bufs' queue, writes them to the 'f_to' file-like object, and
+        returns them to the 'free_bufs' queue. 'F_to' is usually stdin of the
+        decompressor process.
+        """
+
+        try:
+            while True:
+                item = full_bufs.get()
+                if item is None:
+                    break
+
+                buf, size = item
+                f_to.write(buf[:size])
+                free_bufs.put(buf)
+        finally:
+            # Make sure the reader thread does not wait for free buffers
+            # forever if we stopped because of an error.
+            free_bufs.put(None)
             # This will make sure the process decompressor gets EOF and exits, as
             # well as ublocks processes waiting on decompressor's stdin.
             f_to.close()
@@ -232,173 +595,62 @@ class TransRead(object):
         compressed.
         """
 
-        def is_gzip(name):
-            """Returns 'True' if file 'name' is compressed with 'gzip'."""
-            if name.endswith('.gzip') or \
-               (name.endswith('.gz') and not name.endswith('.tar.gz')):
-                return True
-            return False
-
-        def is_bzip2(name):
-            """Returns 'True' if file 'name' is compressed with 'bzip2'."""
-            if name.endswith('.bz2') and not name.endswith('.tar.bz2'):
-                return True
-            return False
-
-        def is_xz(name):
-            """Returns 'True' if file 'name' is compressed with 'xz'."""
-            if name.endswith('.xz') and not name.endswith('.tar.xz'):
-                return True
-            return False
-
-        def is_lzop(name):
-            """Returns 'True' if file 'name' is compressed with 'lzop'."""
-            if name.endswith('.lzo') and not name.endswith('.tar.lzo'):
-                return True
-            return False
-
-        def is_lz4(name):
-            """Returns 'True' if file 'name' is compressed with 'lz4'."""
-            if name.endswith('.lz4') and not name.endswith('.tar.lz4'):
-                return True
-            return False
-
-        def is_zst(name):
-            """Returns 'True' if file 'name' is compressed with 'zstd'."""
-            if name.endswith('.zst') and not name.endswith('.tar.zst'):
-                return True
-            return False
-
-        def is_tar_gz(name):
-            """
-            Returns 'True' if file 'name' is a tar archive compressed with
-            'gzip'.
-            """
-
-            if name.endswith('.tar.gz') or name.endswith('.tgz'):
-                return True
-            return False
-
-        def is_tar_bz2(name):
-            """
-            Returns 'True' if file 'name' is a tar archive compressed with
-            'bzip2'.
-            """
-
-            if name.endswith('.tar.bz2') or name.endswith('.tbz') or \
-               name.endswith('.tbz2') or name.endswith('.tb2'):
-                return True
-            return False
-
-        def is_tar_xz(name):
-            """
-            Returns 'True' if file 'name' is a tar archive compressed with 'xz'.
-            """
-
-            if name.endswith('.tar.xz') or name.endswith('.txz'):
-                return True
-            return False
-
-        def is_tar_lzo(name):
-            """
-            Returns 'True' if file 'name' is a tar archive compressed with
-            'lzop'.
-            """
-
-            if name.endswith('.tar.lzo') or name.endswith('.tzo'):
-                return True
-            return False
-
-        def is_tar_lz4(name):
-            """
-            Returns 'True' if file 'name' is a tar archive compressed with
-            'lz4'.
-            """
-
-            if name.endswith('.tar.lz4') or name.endswith('.tlz4'):
-                return True
-            return False
-
-        def is_tar_zst(name):
-            """
-            Returns 'True' if file 'name' is a tar archive compressed with
-            'zstd'.
-            """
-
-            if name.endswith('.tar.zst') or name.endswith('.tzst'):
-                return True
-            return False
-
-        archiver = None
-        if is_tar_gz(self.name) or is_gzip(self.name):
-            self.compression_type = 'gzip'
-            if BmapHelpers.program_is_available("pigz"):
-                decompressor = "pigz"
-            else:
-                decompressor = "gzip"
+        compression_type, is_tar = _get_compression_type(self.name)
+        if not compression_type:
+            if not self.is_url:
+                self.size = os.fstat(self._f_objs[-1].fileno()).st_size
+            return
 
-            if is_gzip(self.name):
-                args = "-d -c"
+        self.compression_type = compression_type
+        if compression_type == 'gzip':
+            if igzip and (not is_tar or USE_NATIVE_TAR):
+                # Decompress in-process, this avoids running an external
+                # program and pushing all the data through a pipe.
+                self._fake_seek = True
+                file_obj = igzip.IGzipFile(fileobj=self._f_objs[-1], mode='rb')
+                self._f_objs.append(_DecompressedFile(file_obj, self.name))
+                if is_tar:
+                    self._open_tar_stream()
+                return
+
+            for decompressor, args in PARALLEL_GZIP_PROGRAMS:
+                if BmapHelpers.program_is_available(decompressor):
+                    break
             else:
-                archiver = "tar"
-                args = "-x -z -O"
-        elif is_tar_bz2(self.name) or is_bzip2(self.name):
-            self.compression_type = 'bzip2'
-            if BmapHelpers.program_is_available("pbzip2"):
+                decompressor, args = "gzip", ["-d", "-c"]
+        elif compression_type == 'bzip2':
+            if BmapHelpers.program_is_available("lbzip2"):
+                decompressor = "lbzip2"
+            elif BmapHelpers.program_is_available("pbzip2"):
                 decompressor = "pbzip2"
             else:
                 decompressor = "bzip2"
-
-            if is_bzip2(self.name):
-                args = "-d -c"
-            else:
-                archiver = "tar"
-                args = "-x -j -O"
-        elif is_tar_xz(self.name) or is_xz(self.name):
-            self.compression_type = 'xz'
-            decompressor = "xz"
-            if is_xz(self.name):
-                args = "-d -c"
+            args = ["-d", "-c"]
+        elif compression_type == 'xz':
+            if BmapHelpers.program_is_available("pixz"):
+                decompressor = "pixz"
+                args = ["-d"]
             else:
-                archiver = "tar"
-                args = "-x -J -O"
-        elif is_tar_lzo(self.name) or is_lzop(self.name):
-            self.compression_type = 'lzo'
+                # The "-T0" option makes "xz" use all the CPUs for files
+                # compressed in multi-threaded (multi-block) mode
+                decompressor = "xz"
+                args = ["-d", "-c", "-T0"]
+        elif compression_type == 'lzo':
             decompressor = "lzop"
-            if is_lzop(self.name):
-                args = "-d -c"
-            else:
-                archiver = "tar"
-                args = "-x --lzo -O"
-        elif self.name.endswith(".zip"):
-            self.compression_type = 'zip'
+            args = ["-d", "-c"]
+        elif compression_type == 'zip':
             decompressor = "funzip"
-            args = ""
-        elif is_tar_lz4(self.name) or is_lz4(self.name):
-            self.compression_type = 'lz4'
+            args = []
+        elif compression_type == 'lz4':
             decompressor = "lz4"
-            if is_lz4(self.name):
-                args = "-d -c"
-            else:
-                archiver = "tar"
-                args = "-x -Ilz4 -O"
-        elif is_tar_zst(self.name) or is_zst(self.name):
-            self.compression_type = 'zst'
+            args = ["-d", "-c"]
+        elif compression_type == 'zst':
             decompressor = "zstd"
-            if is_zst(self.name):
-                args = "-d"
-            else:
-                archiver = "tar"
-                args = "-x -Izstd -O"
-        else:
-            if not self.is_url:
-                self.size = os.fstat(self._f_objs[-1].fileno()).st_size
-            return
+            args = ["-d"]
 
-        if archiver == "tar":
-            # This will get rid of messages like:
-            #     tar: Removing leading `/' from member names'.
-            args += " -P -C /"
+        archiver = None
+        if is_tar:
+            archiver = "tar"
 
         # Make sure decompressor and the archiver programs are available
         if not BmapHelpers.program_is_available(decompressor):
@@ -411,33 +663,86 @@ class TransRead(object):
 
         # Start the decompressor process. We'll send the data to its stdin and
         # read the decompressed data from its stdout.
-        if archiver:
-            args = archiver + " " + args
-        else:
-            args = decompressor + " " + args
-
-        if self.is_url:
+        # Local files and pipes from our own child processes (e.g., "ssh")
+        # have not been read yet, so their file descriptor is passed to the
+        # decompressor directly. Data received via urllib2 have to go through
+        # a reader thread, because urllib2 buffers and decodes them.
+        if self.is_url and \
+           not isinstance(self._f_objs[-1], (io.FileIO, io.BufferedReader)):
             child_stdin = subprocess.PIPE
         else:
             child_stdin = self._f_objs[-1].fileno()
 
-        child_process = subprocess.Popen(args, shell=True,
-                                         bufsize=1024 * 1024,
+        # The 'bufsize' argument makes the decompressor's stdout a buffered
+        # reader with a 1MiB buffer, so small reads do not result in a system
+        # call each.
+        child_process = subprocess.Popen([decompressor] + args, close_fds=True,
+                                         bufsize=_CHUNK_SIZE,
                                          stdin=child_stdin,
                                          stdout=subprocess.PIPE)
+        _set_pipe_size(child_process.stdout, _CHUNK_SIZE)
 
         if child_stdin == subprocess.PIPE:
-            # A separate reader thread is created only when we are reading via
-            # urllib2.
-            args = (self._f_objs[-1], child_process.stdin, )
-            self._rthread = threading.Thread(target=self._read_thread, args=args)
-            self._rthread.daemon = True
-            self._rthread.start()
+            _set_pipe_size(child_process.stdin, _CHUNK_SIZE)
+            # Separate reader and writer threads are created only when we are
+            # reading via urllib2. They are connected with a queue of buffers,
+            # so that reading from the network and decompressing overlap.
+            full_bufs = queue.Queue()
+            free_bufs = queue.Queue()
+            for _ in range(_PIPELINE_DEPTH):
+                free_bufs.put(memoryview(bytearray(_CHUNK_SIZE)))
+
+            for target, args in \
+                ((self._read_thread, (self._f_objs[-1], full_bufs, free_bufs)),
+                 (self._write_thread, (child_process.stdin, full_bufs,
+                                       free_bufs))):
+                thread = threading.Thread(target=target, args=args)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
 
         self._fake_seek = True
-        self._f_objs.append(child_process.stdout)
         self._child_processes.append(child_process)
 
+        if archiver:
+            # Run the "tar" program in a separate process reading the
+            # decompressor's output, rather than letting "tar" start the
+            # decompressor, so that we choose the (possibly parallel)
+            # decompressor. The "-P -C /" options get rid of messages like:
+            #     tar: Removing leading `/' from member names'.
+            tar_process = subprocess.Popen([archiver, "-x", "-O", "-f", "-",
+                                            "-P", "-C", "/"], close_fds=True,
+                                           bufsize=_CHUNK_SIZE,
+                                           stdin=child_process.stdout,
+                                           stdout=subprocess.PIPE)
+            _set_pipe_size(tar_process.stdout, _CHUNK_SIZE)
+            # The "tar" process has its own copy of the pipe, close ours so
+            # that the decompressor gets SIGPIPE if "tar" exits.
+            child_process.stdout.close()
+            self._f_objs.append(tar_process.stdout)
+            self._child_processes.append(tar_process)
+        else:
+            self._f_objs.append(child_process.stdout)
+
+    def _open_tar_stream(self):
+        """
+        Open the tar archive which is read from the 'self._f_objs[-1]' file
+        object in streaming mode, and append a file object which reads all the
+        regular files of the archive one after another to 'self._f_objs'.
+        """
+
+        try:
+            tar = tarfile.open(fileobj=self._f_objs[-1], mode='r|')
+        except (tarfile.TarError, IOError, EOFError) as err:
+            raise Error("cannot read tar archive '%s': %s" % (self.name, err))
+
+        self._f_objs.append(tar)
+        reader = _TarReader(tar, self.name)
+        if reader.is_empty():
+            raise Error("tar archive '%s' does not contain any regular files"
+                        % self.name)
+        self._f_objs.append(reader)
+
     def _open_url_ssh(self, parsed_url):
         """
         This function opens a file on a remote host using SSH. The URL has to
@@ -493,8 +798,7 @@ class TransRead(object):
         # Test if file exists by running "test -f path && test -r path" on the
         # host
         command = "test -f " + path + " && test -r " + path
-        child_process = subprocess.Popen(popen_args + [command],
-                                         bufsize=1024 * 1024)
+        child_process = subprocess.Popen(popen_args + [command])
         child_process.wait()
         if child_process.returncode != 0:
             raise Error("\"%s\" on \"%s\" cannot be read: make sure it "
@@ -503,7 +807,9 @@ class TransRead(object):
 
         # Read the entire file using 'cat'
         child_process = subprocess.Popen(popen_args + ["cat " + path],
+                                         bufsize=_CHUNK_SIZE,
                                          stdout=subprocess.PIPE)
+        _set_pipe_size(child_process.stdout, _CHUNK_SIZE)
 
         # Now the contents of the file should be available from sub-processes
         # stdout
@@ -527,12 +833,6 @@ class TransRead(object):
                          "proxy configured correctly? Keep trying ..." %
                          timeout)
 
-        import socket
-
-        from six.moves import http_client as httplib
-        from six.moves.urllib import request as urllib
-        from six.moves.urllib.error import URLError
-
         parsed_url = urlparse.urlparse(url)
 
         if parsed_url.scheme == "ssh":
@@ -563,7 +863,6 @@ class TransRead(object):
             opener = urllib.build_opener()
 
         opener.addheaders = [('User-Agent', 'Mozilla/5.0')]
-        urllib.install_opener(opener)
 
         # Open the URL. First try with a short timeout, and print a message
         # which should supposedly give the a clue that something may be going
@@ -572,8 +871,14 @@ class TransRead(object):
         # example, if one tries to open a file but did not setup the proxy
         # environment variables propely, there will be a very long delay before
         # the failure message. And it is much nicer to pre-warn the user early
-        # about something possibly being wrong.
-        for timeout in (10, None):
+        # about something possibly being wrong. If a proxy is configured for
+        # the URL scheme, the warning would not help, so do not try twice.
+        if parsed_url.scheme in urllib.getproxies():
+            timeouts = (None, )
+        else:
+            timeouts = (10, None)
+
+        for timeout in timeouts:
             try:
                 f_obj = opener.open(url, timeout=timeout)
             # Handling the timeout case in Python 2.7
@@ -598,22 +903,119 @@ class TransRead(object):
         self.is_url = True
         self._f_objs.append(f_obj)
 
+    def _check_cached(self, pos):
+        """
+        Raise an exception if the data at position 'pos' cannot be read any
+        longer, because they are behind the stream position and are not in the
+        read cache.
+        """
+
+        if pos < self._stream_pos and pos // _CHUNK_SIZE not in self._cache:
+            raise Error("cannot seek back to offset %d, the data at this "
+                        "offset were skipped or dropped from the read cache"
+                        % pos)
+
+    def _read_block(self, pos, size):
+        """
+        Return up to 'size' bytes from position 'pos' to the end of its block
+        of '_CHUNK_SIZE' bytes, or all of them if 'size' is negative. The block
+        is taken from the read cache, or read from the stream and added to the
+        cache. Returns empty data if 'pos' is at or past the end of the stream.
+        """
+
+        index, offset = divmod(pos, _CHUNK_SIZE)
+        end = offset + size if size >= 0 else _CHUNK_SIZE
+        block = self._cache.pop(index, None)
+        if block is not None:
+            # Move the block to the end, which holds the most recently used ones
+            self._cache[index] = block
+            return block[offset:end]
+
+        # We only stop in the middle of a block at the end of the stream
+        if pos >= self._stream_pos and self._stream_pos % _CHUNK_SIZE:
+            return b""
+
+        self._check_cached(pos)
+
+        start = index * _CHUNK_SIZE
+        self._stream_pos = _fake_seek_forward(self._f_objs[-1],
+                                              self._stream_pos, start)
+        if self._stream_pos < start:
+            return b""
+
+        parts = []
+        to_read = _CHUNK_SIZE
+        while to_read > 0:
+            buf = self._f_objs[-1].read(to_read)
+            if not buf:
+                break
+            parts.append(buf)
+            to_read -= len(buf)
+
+        block = b"".join(parts)
+        self._stream_pos += len(block)
+        if block:
+            self._cache[index] = block
+            while len(self._cache) > self._cache_blocks:
+                self._cache.popitem(last=False)
+
+        return block[offset:end]
+
+    def _read_cached(self, size):
+        """
+        Read 'size' bytes, or everything if 'size' is negative, using the read
+        cache.
+        """
+
+        parts = []
+        while size:
+            buf = self._read_block(self._pos, size)
+            if not buf:
+                break
+            parts.append(buf)
+            self._pos += len(buf)
+            if size > 0:
+                size -= len(buf)
+
+        return b"".join(parts)
+
     def read(self, size=-1):
         """
         Read the data from the file or URL and and uncompress it on-the-fly if
         necessary.
         """
 
+        if self._cache is not None:
+            return self._read_cached(size)
+
         if size < 0:
-            size = 0xFFFFFFFFFFFFFFFF
-        buf = self._f_objs[-1].read(size)
+            if hasattr(self._f_objs[-1], "read1"):
+                # Buffered 'io' objects read everything efficiently themselves
+                buf = self._f_objs[-1].read()
+            else:
+                # Read in chunks, since some file-like objects allocate a
+                # buffer of the requested size
+                parts = []
+                while True:
+                    chunk = self._f_objs[-1].read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    parts.append(chunk)
+                buf = b"".join(parts)
+        else:
+            buf = self._f_objs[-1].read(size)
         self._pos += len(buf)
 
         return buf
 
     def seek(self, offset, whence=os.SEEK_SET):
         """The 'seek()' method, similar to the one file objects have."""
-        if self._fake_seek or not hasattr(self._f_objs[-1], "seek"):
+        if self._cache is not None:
+            # The data are read only when they are requested
+            new_pos = _get_seek_position(self._pos, offset, whence)
+            self._check_cached(new_pos)
+            self._pos = new_pos
+        elif self._fake_seek or not hasattr(self._f_objs[-1], "seek"):
             self._pos = _fake_seek_forward(self._f_objs[-1], self._pos,
                                            offset, whence)
         else:
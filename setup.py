@@ -25,6 +25,10 @@ setup(
         'console_scripts': ['bmaptool=bmaptools.CLI:main'],
     },
     packages=find_packages(exclude=["test*"]),
+    extras_require={
+        # Faster in-process decompression of gzip-compressed images
+        'isal': ['isal'],
+    },
     license='GPLv2',
     long_description="Tools to generate block map (AKA bmap) and flash "
                      "images using bmap. Bmaptool is a generic tool for "
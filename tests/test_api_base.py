@@ -34,9 +34,10 @@ import sys
 import tempfile
 import filecmp
 import subprocess
+from mock import mock
 from six.moves import zip_longest
 from tests import helpers
-from bmaptools import BmapHelpers, BmapCreate, Filemap
+from bmaptools import BmapHelpers, BmapCreate, Filemap, TransRead
 
 # This is a work-around for Centos 6
 try:
@@ -69,13 +70,14 @@ def _compare_holes(file1, file2):
                         % (range1[0], range1[1], range2[0], range2[1]))
 
 
-def _generate_compressed_files(file_path, delete=True):
+def _generate_compressed_files(file_path, delete=True, tar_only=False):
     """
     This is a generator which yields compressed versions of a file
     'file_path'.
 
     The 'delete' argument specifies whether the compressed files that this
-    generator yields have to be automatically deleted.
+    generator yields have to be automatically deleted. If 'tar_only' is 'True',
+    only the compressed tar archives are generated.
     """
 
     # Make sure the temporary files start with the same name as 'file_obj' in
@@ -103,6 +105,8 @@ def _generate_compressed_files(file_path, delete=True):
                    ("zip",   None,  ".zip",     "-q -j -")]
 
     for decompressor, archiver, suffix, options in compressors:
+        if tar_only and not archiver:
+            continue
         if not BmapHelpers.program_is_available(decompressor):
             continue
         if archiver and not BmapHelpers.program_is_available(archiver):
@@ -235,6 +239,23 @@ def _do_test(image, image_size, delete=True):
         helpers.copy_and_verify_image(compressed, f_copy.name, f_bmap1.name,
                                       image_chksum, None)
 
+    #
+    # Pass 7: same as pass 3, but read tar archives with the "tar" program
+    # rather than the 'tarfile' module
+    #
+
+    with mock.patch.object(TransRead, "USE_NATIVE_TAR", False):
+        for compressed in _generate_compressed_files(image, delete=delete,
+                                                     tar_only=True):
+            helpers.copy_and_verify_image(compressed, f_copy.name,
+                                          f_bmap1.name, image_chksum,
+                                          image_size)
+
+            # Append a "file:" prefix to make BmapCopy use urllib
+            compressed = "file:" + compressed
+            helpers.copy_and_verify_image(compressed, f_copy.name,
+                                          f_bmap1.name, image_chksum, None)
+
     # Close temporary files, which will also remove them
     f_copy.close()
     f_bmap1.close()
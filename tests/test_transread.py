@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# vim: ts=4 sw=4 et ai si
+#
+# Copyright (c) 2012-2014 Intel, Inc.
+# License: GPLv2
+# Author: Artem Bityutskiy <artem.bityutskiy@linux.intel.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License, version 2,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+This test verifies 'TransRead' module functionality.
+"""
+
+# Disable the following pylint recommendations:
+#   * Access to a protected member (W0212)
+# pylint: disable=W0212
+
+import io
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import threading
+from mock import mock
+from six.moves import BaseHTTPServer, SimpleHTTPServer
+from bmaptools import BmapHelpers, TransRead
+
+# This is a work-around for Centos 6
+try:
+    import unittest2 as unittest  # pylint: disable=F0401
+except ImportError:
+    import unittest
+
+
+class _IGzipShim(object):  # pylint: disable=R0903
+    """
+    A stand-in for the 'isal.igzip' module, which provides the same
+    'IGzipFile' interface using the 'gzip' module.
+    """
+
+    IGzipFile = gzip.GzipFile
+
+
+class _QuietHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    An HTTP request handler which serves the files from the current directory
+    and does not print the requests.
+    """
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        """Do not print the requests."""
+        pass
+
+
+class TestTransRead(unittest.TestCase):
+    """The test class for these unit tests."""
+
+    def setUp(self):
+        """Create a temporary directory for the test files."""
+        self._directory = tempfile.mkdtemp(prefix="testdir_", dir=".")
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self._directory)
+
+    def _create_tar(self, mode, suffix, members):
+        """
+        Create a tar archive using 'tarfile' mode 'mode' and file name suffix
+        'suffix'. The 'members' argument is a list of '(name, data)' tuples,
+        members with 'None' data are directories. Returns the archive path.
+        """
+
+        path = os.path.join(self._directory, "archive" + suffix)
+        with tarfile.open(path, mode) as tar:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                if data is None:
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                else:
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+
+        return path
+
+    def test_tar_members(self):
+        """
+        Check that all regular files of a tar archive are read one after
+        another, both with the 'tarfile' module and the "tar" program
+        """
+
+        if not BmapHelpers.program_is_available("gzip") or \
+           not BmapHelpers.program_is_available("tar"):
+            self.skipTest("the \"gzip\" or \"tar\" program is not available")
+
+        path = self._create_tar("w:gz", ".tar.gz",
+                                [("a", b"AAAA"), ("d", None), ("b", b"BBBB")])
+
+        # The 'tarfile' module is used only for archives decompressed
+        # in-process, otherwise the decompressor and "tar" run as two separate
+        # processes
+        for igzip, use_native_tar, processes in ((_IGzipShim, True, 0),
+                                                 (_IGzipShim, False, 2),
+                                                 (None, True, 2)):
+            with mock.patch.object(TransRead, "igzip", igzip), \
+                 mock.patch.object(TransRead, "USE_NATIVE_TAR",
+                                   use_native_tar):
+                file_obj = TransRead.TransRead(path)
+                self.assertEqual(len(file_obj._child_processes), processes)
+                self.assertEqual(file_obj.read(3), b"AAA")
+                file_obj.seek(5)
+                self.assertEqual(file_obj.read(), b"BBB")
+                file_obj.close()
+
+    def test_truncated_tar(self):
+        """
+        Check that reading a truncated tar archive with the 'tarfile' module
+        results in 'Error'
+        """
+
+        path = self._create_tar("w", ".tar",
+                                [("a", os.urandom(4 * 1024 * 1024))])
+        with open(path, "rb+") as f_tar:
+            f_tar.truncate(os.path.getsize(path) // 2)
+        with open(path, "rb") as f_tar:
+            with gzip.open(path + ".gz", "wb") as f_gzip:
+                shutil.copyfileobj(f_tar, f_gzip)
+
+        with mock.patch.object(TransRead, "igzip", _IGzipShim), \
+             mock.patch.object(TransRead, "USE_NATIVE_TAR", True):
+            file_obj = TransRead.TransRead(path + ".gz")
+            self.assertRaises(TransRead.Error, file_obj.read)
+            file_obj.close()
+
+    def _create_gzip(self, data):
+        """Create a gzip-compressed file with 'data'. Returns its path."""
+
+        path = os.path.join(self._directory, "image.gz")
+        with gzip.open(path, "wb") as f_gzip:
+            f_gzip.write(data)
+
+        return path
+
+    def test_read_cache(self):
+        """Check seeking and reading with the read cache enabled"""
+
+        chunk_size = TransRead._CHUNK_SIZE
+        data = bytes(bytearray(range(256))) * (7 * chunk_size // 512)
+        path = self._create_gzip(data)
+
+        environ = {TransRead.CACHE_SIZE_ENV: str(2 * chunk_size // 1048576)}
+        with mock.patch.dict(os.environ, environ):
+            file_obj = TransRead.TransRead(path)
+
+        # Read the first 2 blocks, which fit into the cache, and seek back
+        self.assertEqual(file_obj.read(chunk_size + 10),
+                         data[:chunk_size + 10])
+        file_obj.seek(5)
+        self.assertEqual(file_obj.tell(), 5)
+        self.assertEqual(file_obj.read(4096), data[5:4101])
+        file_obj.seek(chunk_size - 2)
+        self.assertEqual(file_obj.read(4), data[chunk_size - 2:chunk_size + 2])
+
+        # Skip block 2 and read block 3, which drops block 0 from the cache
+        file_obj.seek(3 * chunk_size + 1)
+        self.assertEqual(file_obj.read(10),
+                         data[3 * chunk_size + 1:3 * chunk_size + 11])
+        file_obj.seek(-5, os.SEEK_CUR)
+        self.assertEqual(file_obj.read(5),
+                         data[3 * chunk_size + 6:3 * chunk_size + 11])
+        file_obj.seek(chunk_size + 1)
+        self.assertEqual(file_obj.read(10), data[chunk_size + 1:chunk_size + 11])
+
+        # Block 2 was skipped and block 0 was dropped from the cache
+        self.assertRaises(TransRead.Error, file_obj.seek, 2 * chunk_size)
+        self.assertRaises(TransRead.Error, file_obj.seek, 0)
+
+        # Seek and read past the end of the file
+        file_obj.seek(len(data) - 3)
+        self.assertEqual(file_obj.read(10), data[-3:])
+        self.assertEqual(file_obj.read(), b"")
+        file_obj.seek(len(data) + chunk_size)
+        self.assertEqual(file_obj.read(), b"")
+        file_obj.seek(len(data) - 1)
+        self.assertEqual(file_obj.read(), data[-1:])
+
+        file_obj.close()
+
+    def test_url_read_cache(self):
+        """
+        Check seeking backwards in an uncompressed file behind an HTTP URL with
+        the read cache enabled
+        """
+
+        chunk_size = TransRead._CHUNK_SIZE
+        data = os.urandom(2 * chunk_size + 100)
+        path = os.path.join(self._directory, "image")
+        with open(path, "wb") as f_image:
+            f_image.write(data)
+
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+                                           _QuietHTTPRequestHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            url = "http://127.0.0.1:%d/%s" % (server.server_port,
+                                              os.path.relpath(path))
+            environ = {TransRead.CACHE_SIZE_ENV: "8", "no_proxy": "127.0.0.1"}
+            with mock.patch.dict(os.environ, environ):
+                file_obj = TransRead.TransRead(url)
+
+            self.assertEqual(file_obj.read(10), data[:10])
+            file_obj.seek(0)
+            self.assertEqual(file_obj.tell(), 0)
+            self.assertEqual(file_obj.read(chunk_size + 10),
+                             data[:chunk_size + 10])
+            file_obj.seek(5)
+            self.assertEqual(file_obj.read(), data[5:])
+            file_obj.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_in_process_gzip(self):
+        """
+        Check reading gzip-compressed files and tar archives with the
+        in-process decompressor
+        """
+
+        data = bytes(bytearray(range(256))) * 4096
+        paths = [self._create_gzip(data),
+                 self._create_tar("w:gz", ".tar.gz",
+                                  [("a", data[:1000]), ("b", data[1000:])])]
+
+        with mock.patch.object(TransRead, "igzip", _IGzipShim):
+            for path in paths:
+                file_obj = TransRead.TransRead(path)
+                self.assertEqual(file_obj.compression_type, "gzip")
+                self.assertFalse(file_obj._child_processes)
+                self.assertEqual(file_obj.read(10), data[:10])
+                file_obj.seek(900)
+                self.assertEqual(file_obj.read(200), data[900:1100])
+                file_obj.seek(50000, os.SEEK_CUR)
+                self.assertEqual(file_obj.tell(), 51100)
+                self.assertEqual(file_obj.read(), data[51100:])
+                file_obj.close()
+
+            # A truncated file must result in 'Error', not in a decompressor
+            # exception
+            with open(paths[0], "rb+") as f_gzip:
+                f_gzip.truncate(os.path.getsize(paths[0]) // 2)
+            file_obj = TransRead.TransRead(paths[0])
+            self.assertRaises(TransRead.Error, file_obj.read)
+            file_obj.close()